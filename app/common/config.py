@@ -115,6 +115,9 @@ class Config(QConfig):
     autoSpeedUp = ConfigItem("Download", "AutoSpeedUp", True, BoolValidator())
     SSLVerify = ConfigItem("Download", "SSLVerify", False, BoolValidator(), restart=True)
     enableDufsParsing = ConfigItem("Download", "EnableDufsParsing", False, BoolValidator())
+    dufsParseConcurrency = RangeConfigItem(
+        "Download", "DufsParseConcurrency", 16, RangeValidator(1, 64)
+    )
     proxyServer = ConfigItem("Download", "ProxyServer", "Auto", ProxyValidator())
 
     # browser
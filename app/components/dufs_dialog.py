@@ -1,33 +1,62 @@
 # app/components/dufs_dialog.py
 
+import asyncio
+import functools
 import os
+import sys
 import json
-from urllib.parse import urljoin, unquote, urlparse, urlunparse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, quote, urlparse, urlunparse
+
+import curl_cffi
 from PySide6.QtCore import Qt, Signal, QThread
 from PySide6.QtWidgets import QTreeWidget, QTreeWidgetItem, QPushButton, QVBoxLayout, QHBoxLayout
 from qfluentwidgets import FluentIcon as FIF, SubtitleLabel, MessageBoxBase, LineEdit, InfoBar, InfoBarPosition
 from loguru import logger
 
-from ..common.methods import addDownloadTask
+from ..common.methods import addDownloadTask, getProxy
 from .select_folder_setting_card import SelectFolderSettingCard
 from ..common.config import cfg
 
+try:  # orjson 解析大型目錄 JSON 快數倍, 未安裝時退回標準庫
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# 同名檔案 (README、index.html...) 在各目錄間大量重複, 快取編解碼結果
+_quote = functools.lru_cache(maxsize=4096)(quote)
+_unquote = functools.lru_cache(maxsize=4096)(unquote)
+
+_DIR = sys.intern('Dir')  # interned 後同一字串比較可走指標快路徑
+
+
+def _normalize_dir_url(url):
+    """ 去除查詢與片段並統一結尾斜線, 避免等價 URL 被重複抓取 """
+    parsed = urlparse(url)._replace(query='', fragment='')
+    return urlunparse(parsed).rstrip('/') + '/'
+
+
 class ParseDufsThread(QThread):
     """ 用於解析 dufs 網頁的執行緒 """
-    finished_signal = Signal(str, list)
+    finished_signal = Signal(str)
+    batch_signal = Signal(list)  # 每處理完一個目錄就發出現成的樹狀項目, 讓樹狀圖邊解析邊填充
     error_signal = Signal(str)
 
     def __init__(self, url, parent=None):
         super().__init__(parent)
-        self.initial_url = url.strip()
-        # 確保 initial_url 以斜線結尾，方便後續路徑拼接
-        if not self.initial_url.endswith('/'):
-            self.initial_url += '/'
-            
-        self.files_to_process = [{'type': 'Dir', 'url': self.initial_url}]
+        self.worker_num = cfg.dufsParseConcurrency.value  # 同時抓取目錄的協程數量
+        # 正規化後保證以斜線結尾，方便後續路徑拼接
+        self.initial_url = _normalize_dir_url(url.strip())
+
+        # 基底 URL 只需解析一次, 供 href='/' 時的根目錄名稱後備使用
+        self._parsed_base = urlparse(self.initial_url)
+        self._base_path = self._parsed_base.path
+
         self.processed_urls = set()
-        self.headers = {'User-Agent': 'Mozilla/5.0'}
+        # 目錄 JSON 的鍵名高度重複, gzip 可大幅減少傳輸量; curl_cffi 會自動解壓縮
+        self.headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, deflate'}
+        self.session = None
         self.running = True
 
     def stop(self):
@@ -37,71 +66,141 @@ class ParseDufsThread(QThread):
 
     def run(self):
         logger.info(f"Starting Dufs parsing for base URL: {self.initial_url}")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
         try:
-            all_files = []
-            
+            root_folder_name = loop.run_until_complete(self._parse())
+            if self.running:
+                self.finished_signal.emit(root_folder_name)
+                logger.success("Dufs parsing finished successfully.")
+        except Exception as e:
+            logger.error(f"An error occurred during parsing: {e}")
+            if self.running:
+                self.error_signal.emit(str(e))
+        finally:
+            loop.close()
+
+    async def _parse(self):
+        # 整個連線池隨協程數量配置, 避免超出池上限的請求建立用完即棄的連線
+        # 乘 2 是因為每個協程抓目錄之外還會順帶發出 HEAD 預檢
+        self.session = curl_cffi.AsyncSession(
+            headers=self.headers,
+            verify=cfg.SSLVerify.value,
+            proxy=getProxy(),
+            max_clients=self.worker_num * 2,
+            trust_env=False,
+        )
+        async with self.session as session:
             # 首先獲取根目錄的 JSON 以取得 href
             initial_json_url = f"{self.initial_url}?json"
             logger.debug(f"Fetching initial JSON from: {initial_json_url}")
-            req = urllib.request.Request(initial_json_url, headers=self.headers)
-            with urllib.request.urlopen(req) as response:
-                if response.status != 200:
-                    raise Exception(f"請求根目錄失敗，狀態碼: {response.status}")
-                initial_data = json.loads(response.read().decode('utf-8'))
-            
+            response = await session.get(initial_json_url)
+            if response.status_code != 200:
+                raise Exception(f"請求根目錄失敗，狀態碼: {response.status_code}")
+            initial_data = _loads(response.content)
+
             root_folder_name = unquote(initial_data.get('href', '/')).strip('/')
             if not root_folder_name: # 如果根目錄是'/'，則從URL中提取最後一部分
-                 root_folder_name = unquote(urlparse(self.initial_url).path.strip('/').split('/')[-1])
+                 root_folder_name = unquote(self._base_path.strip('/').split('/')[-1])
             logger.info(f"Determined root folder name: {root_folder_name}")
 
-            while self.files_to_process:
-                if not self.running:
-                    logger.warning("Parsing interrupted by user.")
-                    return
+            # BFS 改為 asyncio.Queue + 多協程併發抓取, 總耗時從 RTT 之和縮短為約 max-RTT × 深度
+            queue = asyncio.Queue()
+            queue.put_nowait(self.initial_url)
+            self.found_files = 0
+
+            workers = [
+                asyncio.ensure_future(self._worker(session, queue))
+                for _ in range(self.worker_num)
+            ]
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
-                current_item = self.files_to_process.pop(0)
-                current_url = current_item['url']
+            logger.info(f"Discovered {self.found_files} files across {len(self.processed_urls)} directories")
+            return root_folder_name
 
-                if current_url in self.processed_urls:
+    async def _worker(self, session, queue):
+        base_len = len(self.initial_url)
+        while True:
+            current_url = await queue.get()
+            try:
+                # 停止時僅清空佇列, 讓 queue.join() 盡快返回
+                if not self.running or current_url in self.processed_urls:
                     continue
                 self.processed_urls.add(current_url)
 
                 json_url = f"{current_url}?json"
                 logger.debug(f"Processing directory: {json_url}")
-                
-                req = urllib.request.Request(json_url, headers=self.headers)
-                with urllib.request.urlopen(req) as response:
-                    if response.status != 200:
-                        logger.warning(f"Failed to fetch {json_url}, status: {response.status}. Skipping.")
-                        continue
-                    content = response.read().decode('utf-8')
-                    data = json.loads(content)
+
+                response = await session.get(json_url)
+                if response.status_code != 200:
+                    logger.warning(f"Failed to fetch {json_url}, status: {response.status_code}. Skipping.")
+                    continue
+                data = _loads(response.content)
+
+                # current_url 一定以 initial_url 為前綴且以斜線結尾, 直接切片即可取得相對路徑
+                rel_dir = _unquote(current_url[base_len:])
+                # 平行列表取代每檔一個 dict, 省下大量小字典的配置與查找
+                names = []
+                urls = []
+                paths = []
+                head_tasks = []
 
                 for path_info in data.get('paths', []):
+                    # 中斷時跳出但不結束協程, 協程須留下來清空佇列, 否則 queue.join() 不會返回
                     if not self.running:
                         logger.warning("Parsing interrupted by user inside loop.")
-                        return
-                        
+                        break
+
                     name = path_info['name']
-                    encoded_name = urllib.parse.quote(name)
-                    full_url = urljoin(current_url, encoded_name)
-                    
-                    relative_path = unquote(full_url.replace(self.initial_url, ''))
-                    
-                    if path_info['path_type'] == 'Dir':
-                        logger.info(f"Found directory: {name}")
-                        self.files_to_process.append({'type': 'Dir', 'url': f"{full_url}/"})
+                    path_type = path_info['path_type']
+                    full_url = current_url + _quote(name)
+
+                    relative_path = rel_dir + name
+
+                    if path_type == _DIR:
+                        # 每個條目都記 info 在大樹上會花數秒純格式化時間, lazy debug 在關閉時零成本
+                        logger.opt(lazy=True).debug("Found directory: {}", lambda n=name: n)
+                        queue.put_nowait(_normalize_dir_url(f"{full_url}/"))
                     else:
-                        logger.info(f"Found file: {name} at path: {relative_path}")
-                        all_files.append({'name': name, 'url': full_url, 'path': relative_path})
-            
-            if self.running:
-                self.finished_signal.emit(root_folder_name, all_files)
-                logger.success("Dufs parsing finished successfully.")
-        except Exception as e:
-            logger.error(f"An error occurred during parsing: {e}")
-            if self.running:
-                self.error_signal.emit(str(e))
+                        logger.opt(lazy=True).debug(
+                            "Found file: {} at path: {}", lambda n=name: n, lambda p=relative_path: p
+                        )
+                        names.append(name)
+                        urls.append(full_url)
+                        paths.append(relative_path)
+                        # 用同一個連線池順帶發 HEAD 預先取得檔案大小, 與目錄抓取重疊進行
+                        head_tasks.append(asyncio.ensure_future(session.head(full_url)))
+
+                sizes = []
+                for url, head_task in zip(urls, head_tasks):
+                    size = -1
+                    try:
+                        head_response = await head_task
+                        size = int(head_response.headers.get('content-length', -1))
+                    except Exception as e:
+                        logger.debug(f"HEAD pre-flight failed for {url}: {e}")
+                    sizes.append(size)
+
+                self.found_files += len(names)
+
+                if names:
+                    # 無父項的 QTreeWidgetItem 可在工作執行緒安全建構, 把 N 次物件建立成本移出 UI 執行緒
+                    items = []
+                    for name, url, path, size in zip(names, urls, paths, sizes):
+                        item = QTreeWidgetItem(None, [name, path])
+                        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                        item.setCheckState(0, Qt.Checked)
+                        item.setData(0, Qt.UserRole, url)
+                        item.setData(0, Qt.UserRole + 1, size)
+                        items.append(item)
+                    self.batch_signal.emit(items)
+            except Exception as e:
+                logger.warning(f"Failed to process directory {current_url}: {e}")
+            finally:
+                queue.task_done()
 
 
 class DufsDialog(MessageBoxBase):
@@ -152,23 +251,29 @@ class DufsDialog(MessageBoxBase):
             self.parse_thread.stop()
             self.parse_thread.wait()
 
+        self.fileTree.clear()
         self.parse_thread = ParseDufsThread(url)
         self.parse_thread.finished_signal.connect(self.on_parsing_finished)
+        self.parse_thread.batch_signal.connect(self.on_batch_received)
         self.parse_thread.error_signal.connect(self.on_parsing_error)
         self.parse_thread.start()
         self.parseButton.setText("解析中...")
         self.parseButton.setEnabled(False)
         self.yesButton.setEnabled(False)
 
-    def on_parsing_finished(self, root_folder, file_list):
+    def on_batch_received(self, items):
+        # 項目已在解析執行緒建構完成, UI 執行緒只需一次性掛載
+        if not self.isVisible(): return
+        if self.sender() is not self.parse_thread: return  # 忽略已停止執行緒的殘留批次
+        self.fileTree.setUpdatesEnabled(False)
+        try:
+            self.fileTree.invisibleRootItem().addChildren(items)
+        finally:
+            self.fileTree.setUpdatesEnabled(True)
+
+    def on_parsing_finished(self, root_folder):
         if not self.isVisible(): return
         self.root_folder = root_folder
-        self.fileTree.clear()
-        for file_info in file_list:
-            item = QTreeWidgetItem(self.fileTree, [file_info['name'], file_info['path']])
-            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
-            item.setCheckState(0, Qt.Checked)
-            item.setData(0, Qt.UserRole, file_info['url'])
         self.parseButton.setText("解析")
         self.parseButton.setEnabled(True)
         self.yesButton.setEnabled(True)
@@ -192,10 +297,11 @@ class DufsDialog(MessageBoxBase):
             download_path = self.downloadFolderCard.editableComboBox.default
         
         task_root_path = os.path.join(download_path, self.root_folder)
-        if not os.path.exists(task_root_path):
-            os.makedirs(task_root_path)
-            logger.info(f"Created root download directory: {task_root_path}")
+        os.makedirs(task_root_path, exist_ok=True)
+        logger.info(f"Ensured root download directory: {task_root_path}")
 
+        created_dirs = {task_root_path}  # 許多檔案共用目錄, 記住已建立者省去重複 syscall
+        task_dicts = []
         root_item = self.fileTree.invisibleRootItem()
         for i in range(root_item.childCount()):
             item = root_item.child(i)
@@ -203,13 +309,21 @@ class DufsDialog(MessageBoxBase):
                 file_name = item.text(0)
                 relative_path = item.text(1)
                 url = item.data(0, Qt.UserRole)
+                file_size = item.data(0, Qt.UserRole + 1)
 
                 local_file_path = os.path.join(task_root_path, os.path.dirname(relative_path))
-                if not os.path.exists(local_file_path):
-                    os.makedirs(local_file_path)
-                
+                if local_file_path not in created_dirs:
+                    os.makedirs(local_file_path, exist_ok=True)
+                    created_dirs.add(local_file_path)
+
                 logger.info(f"Adding download task: URL='{url}', FileName='{file_name}', Path='{local_file_path}'")
-                addDownloadTask(url=url, fileName=file_name, filePath=local_file_path, notCreateHistoryFile=True)
+                task_dicts.append({'url': url, 'fileName': file_name, 'filePath': local_file_path,
+                                   'notCreateHistoryFile': True,
+                                   'fileSize': file_size if file_size is not None else -1})
+
+        # 建立任務涉及 I/O, 交給執行緒池併發處理, 避免阻塞 UI 執行緒
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda kwargs: addDownloadTask(**kwargs), task_dicts))
 
         self.accept() # 使用 accept() 關閉對話框
 